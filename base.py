@@ -3,15 +3,39 @@ import logging
 import re
 import uuid
 
-from datetime import datetime
+from datetime import date, datetime
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Callable, Optional
+from typing import Any, Callable, List, Mapping, NamedTuple, Optional, Sequence
 from urllib.parse import unquote
 
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+MB = 1024 * 1024
+
+# objects transferred at a time and the parts transferred at a time per object; the connection
+# pool is sized for both so concurrent transfers don't discard pooled connections
+MAX_TRANSFERS = 8
+MAX_TRANSFER_CONCURRENCY = 4
 
 logger = logging.getLogger(__file__)
-s3 = boto3.client('s3')
+
+# created once per container so warm invocations reuse pooled connections
+s3 = boto3.client(
+    's3',
+    config=Config(
+        max_pool_connections=MAX_TRANSFERS * MAX_TRANSFER_CONCURRENCY,
+        retries={'mode': 'adaptive', 'max_attempts': 5},
+    ),
+)
+transfer_config = TransferConfig(
+    multipart_threshold=8 * MB,
+    multipart_chunksize=8 * MB,
+    max_concurrency=MAX_TRANSFER_CONCURRENCY,
+)
 
 
 # Exceptions
@@ -21,13 +45,33 @@ s3 = boto3.client('s3')
 class ValidationError(Exception):
     """Error raised for invalid data."""
 
-    pass
+    @classmethod
+    def combine(cls, errors: List['ValidationError']) -> 'ValidationError':
+        """Returns a single error reporting all the provided errors."""
+        if len(errors) == 1:
+            return errors[0]
+
+        return cls('; '.join(str(err) for err in errors))
 
 
 # Types
 # ==============================================================
 
 
+Record = Mapping[str, Optional[str]]
+
+
+class Row(NamedTuple):
+    """Represents a csv record with its values in the 'uploads' table column order."""
+
+    batch: str
+    start: str
+    end: str
+    records: str
+    pass_: str
+    message: str
+
+
 class AttrDict(dict):
     """Represents a dict that allows attribute-style access."""
 
@@ -37,7 +81,8 @@ class AttrDict(dict):
 
         if is_dict(value):
             value = self[name] = AttrDict(value)  # type: ignore
-        elif isinstance(value, (list, tuple)):
+        elif isinstance(value, tuple) or (isinstance(value, list) and any(map(is_dict, value))):
+            # converted lists are stored back hence later accesses skip the rebuild
             value = [AttrDict(item) if is_dict(item) else item for item in value]
             self[name] = value
 
@@ -62,11 +107,12 @@ class S3ObjInfo:
         self.bucket = bucket
         self.key = key
         self.__local_filepath = None
-        self.__content_type = None
+        self.__not_found = False
 
     @property
-    def content_type(self):
-        return self.__content_type
+    def not_found(self):
+        """Indicates whether the last download found no object at the key."""
+        return self.__not_found
 
     @property
     def local_filepath(self):
@@ -78,8 +124,8 @@ class S3ObjInfo:
 
     def _generate_local_name(self):
         """Returns a randomly generated name that the S3 object can go by locally."""
-        local_key = unquote(self.key).replace('/', '')
-        return f'{uuid.uuid4()}_{local_key}'
+        local_key = unquote(self.key) if '%' in self.key else self.key
+        return f"{uuid.uuid4().hex}_{local_key.replace('/', '')}"
 
     def download(self, dest_dir: Path):
         """Downloads S3 object.
@@ -88,29 +134,37 @@ class S3ObjInfo:
         :type dest_path: str
         :return: Path to the file representing downloaded s3 object.
         :rtype: str
+        :raises Exception: if the download fails for any reason other than a missing object.
         """
         logger.info(f'Downloading S3 object: {self.key} ...')
         self.__local_filepath = dest_dir / self._generate_local_name()
+        self.__not_found = False
 
         try:
-            response = s3.get_object(Bucket=self.bucket, Key=self.key)
-            self.__content_type = response['ContentType']
-
             logger.debug('Saving s3 object locally...')
-            data = response['Body'].read()
-            with self.local_filepath.open('wb') as f:
-                f.write(data)
-                f.flush()
+            s3.download_file(
+                self.bucket, self.key, str(self.local_filepath), Config=transfer_config
+            )
+        except ClientError as ex:
+            # the transfer manager starts with a HEAD request whose response carries no body
+            # hence a missing object is reported as a bare 404
+            if ex.response.get('Error', {}).get('Code') == '404':
+                logger.info(f'S3 object not found: {self.key}')
+                self.__not_found = True
+                return
+
+            logger.error(f'Object download failed. {ex}')
+            raise
         except Exception as ex:
             logger.error(f'Object download failed. {ex}')
+            raise
 
     def upload(self):
         """Upload local file to S3."""
         if not self.local_exists:
             return
 
-        with self.local_filepath.open('rb') as f:
-            s3.put_object(Bucket=self.bucket, Key=self.key, Body=f)
+        s3.upload_file(str(self.local_filepath), self.bucket, self.key, Config=transfer_config)
 
 
 # Validators
@@ -120,34 +174,92 @@ class S3ObjInfo:
 class BatchValidator:
     """Ensures that batch values are 20 characters long and characters only."""
 
+    __slots__ = ('length',)
+
     length: int
 
     def __init__(self, length: int = 20):
         self.length = length
-        self.pattern = re.compile(f'[a-zA-Z]{{{length}}}')
+
+    def check(self, value: str) -> bool:
+        """Returns True if the provided value is valid."""
+        # isascii/isalpha are C-level scans of the string buffer and cheaper than a regex
+        return len(value) == self.length and value.isascii() and value.isalpha()
 
     def __call__(self, value: str):
-        match = self.pattern.match(value)
-        if not match or len(value) != self.length:
+        if not self.check(value):
             raise ValidationError(f'Invalid batch provided: {value}')
 
 
 class BoolValidator:
     """Validates boolean string values."""
 
+    __slots__ = ()
+
+    values = frozenset(('true', 'false'))
+    common_values = values | frozenset(('True', 'TRUE', 'False', 'FALSE'))
+    lengths = frozenset(len(value) for value in values)
+
+    def check(self, value: str) -> bool:
+        """Returns True if the provided value is valid."""
+        # other casings are lowered only when of a valid length, sparing the str allocation
+        return value in self.common_values or (
+            len(value) in self.lengths and value.lower() in self.values
+        )
+
     def __call__(self, value: str):
-        if (value or '').lower() not in ('false', 'true'):
+        if not self.check(value or ''):
             raise ValidationError(f'Invalid boolean value: {value}')
 
 
-class DateValidator:
-    def __init__(self, fmt: str = '%Y-%m-%d'):
-        self.format = fmt
+@lru_cache(maxsize=4096)
+def _strptime(value: str, format: str) -> datetime:  # noqa: A002
+    return datetime.strptime(value, format)
 
-    def __call__(self, value: str):
+
+class DateValidator:
+    """Validates date values against a strptime format."""
+
+    __slots__ = ('format', '_iso_parser', '_iso_length')
+
+    # the common ISO-8601 formats are parsed with the C-implemented `fromisoformat`; as newer
+    # Pythons accept other ISO-8601 variants, values are first checked to have the fixed length
+    # and separators of the format (every 3rd character from the 5th) without the cost of a
+    # regex. This is deliberately stricter than `strptime`, which also accepts fields that are
+    # not zero-padded (e.g. '2003-9-12'); such values would neither sort as text nor work with
+    # SQLite's date functions once stored
+    iso_parsers = {
+        '%Y-%m-%d': ('--', date.fromisoformat),
+        '%Y-%m-%dT%H:%M:%S': ('--T::', datetime.fromisoformat),
+    }
+
+    def __init__(self, format: str = '%Y-%m-%d'):  # noqa: A002
+        self.format = format
+        self._iso_parser = self.iso_parsers.get(format)
+        self._iso_length = 4 + 3 * len(self._iso_parser[0]) if self._iso_parser else 0
+
+    def check(self, value: str) -> bool:
+        """Returns True if the provided value is valid."""
         try:
-            datetime.strptime(value, self.format)
+            if self._iso_parser is None:
+                # values repeat across rows hence are memoized as strptime is slow
+                _strptime(value, self.format)
+                return True
+
+            # malformed values are rejected without raising and catching an error
+            separators, parse = self._iso_parser
+            if len(value) != self._iso_length or value[4::3] != separators:
+                return False
+            if not value.isascii():
+                return False
+
+            parse(value)
+            return True
         except ValueError:
+            return False
+
+    def __call__(self, value: str):
+        if not self.check(value):
             raise ValidationError(
                 f'Invalid date value: {value}. Expected format: {self.format}'
             )
@@ -156,10 +268,20 @@ class DateValidator:
 class FuncValidator:
     """Validator which relegated validation to a callable."""
 
+    __slots__ = ('label', 'func')
+
     def __init__(self, func: Callable, label: str = None):
         self.label = label
         self.func = func
 
+    def check(self, value: str) -> bool:
+        """Returns True if the provided value is valid."""
+        try:
+            self.func(value)
+            return True
+        except Exception:
+            return False
+
     def __call__(self, value: str):
         try:
             self.func(value)
@@ -169,6 +291,56 @@ class FuncValidator:
             )
 
 
+class IntValidator:
+    """Validates integer string values without relying on `int` raising for invalid values.
+
+    With `signed` disabled only plain digit strings are valid, as fits counts. Surrounding
+    ASCII whitespace is allowed as by `int`, and SQLite drops it storing the value as an
+    integer; digit separators ('1_000') and non-ASCII digits, which `int` also accepts, are
+    rejected as SQLite would store them as TEXT.
+    """
+
+    __slots__ = ('signed',)
+
+    signed: bool
+    whitespace = ' \t\n\r\x0b\x0c'
+
+    def __init__(self, signed: bool = True):
+        self.signed = signed
+
+    def check(self, value: str) -> bool:
+        """Returns True if the provided value is valid."""
+        # strip returns the value itself, without a copy, when there is nothing to strip
+        value = value.strip(self.whitespace)
+
+        # isdecimal alone accepts non-ASCII digits which SQLite would store as TEXT
+        if not self.signed:
+            return value.isascii() and value.isdecimal()
+
+        digits = value[1:] if value[:1] in ('+', '-') else value
+        return digits.isascii() and digits.isdecimal()
+
+    def __call__(self, value: str):
+        if not self.check(value):
+            raise ValidationError(f'Invalid integer value: {value}')
+
+
+class FloatValidator:
+    """Validates decimal (finite) float string values against a precompiled pattern."""
+
+    __slots__ = ()
+
+    pattern = re.compile(r'[+-]?(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?', re.ASCII)
+
+    def check(self, value: str) -> bool:
+        """Returns True if the provided value is valid."""
+        return self.pattern.fullmatch(value) is not None
+
+    def __call__(self, value: str):
+        if not self.check(value):
+            raise ValidationError(f'Invalid float value: {value}')
+
+
 def _notempty(value: str):
     if value in (None, '') or len(value.strip()) == 0:
         raise ValueError('Value cannot be empty or whitespaces only')
@@ -177,6 +349,31 @@ def _notempty(value: str):
 NotEmptyValidator = FuncValidator(_notempty)
 
 
+def checker(validator: Callable[[str], None]) -> Callable[[str], bool]:
+    """Returns a function which checks values against the validator without raising errors.
+
+    This is the `check` method for validators providing one otherwise the validator is called
+    with raised errors reported as invalid values.
+    """
+    check = getattr(validator, 'check', None)
+    if check is not None:
+        return check
+
+    def check_value(value: str) -> bool:
+        try:
+            validator(value)
+            return True
+        except ValidationError:
+            return False
+
+    return check_value
+
+
+def bulk_validate(validator: Callable[[str], None], values: Sequence[str]) -> List[bool]:
+    """Returns flags indicating which of the provided values are valid."""
+    return list(map(checker(validator), values))
+
+
 class RowValidator:
     """Defines rules for validating csv records to ensure column data are of expected type/format."""  # noqa
 
@@ -188,26 +385,96 @@ class RowValidator:
             'batch': BatchValidator(),
             'start': datetime_validator,
             'end': datetime_validator,
-            'records': FuncValidator(int),
+            'records': IntValidator(signed=False),
             'pass': BoolValidator(),
             'message': NotEmptyValidator,
         }
     )
 
-    def __call__(self, row: AttrDict):
-        for name, validator in self.columns.items():
-            value = row.get(name)
-            if not value:
-                raise ValidationError(f'Missing value for {name}')
+    @staticmethod
+    def _error(name: str, validator: Callable[[str], None], value: str) -> ValidationError:
+        """Returns the error for a column value already found to be invalid."""
+        if not value:
+            return ValidationError(f'Missing value for {name}')
 
+        try:
             validator(value)
+        except ValidationError as ex:
+            return ex
+
+        return ValidationError(f'Invalid value for {name}: {value}')
+
+    def errors(self, row: Record) -> List[ValidationError]:
+        """Returns the errors for all invalid column values of the provided row."""
+        columns = [[row.get(name) or ''] for name in self.columns]
+        return self._column_errors(columns, count=1)[0] or []
 
-    def is_valid(self, row: AttrDict) -> bool:
+    def __call__(self, row: Record):
+        errors = self.errors(row)
+        if errors:
+            raise ValidationError.combine(errors)
+
+    def validate_batch(self, rows: List[Record]) -> List[Optional[ValidationError]]:
+        """Validates a batch of rows a column at a time.
+
+        :param rows: records to be validated.
+        :type rows: List[Record]
+        :return: the validation error for each row in the batch or None for valid rows.
+        :rtype: List[Optional[ValidationError]]
+        """
+        return self.validate_columns(
+            [[row.get(name) or '' for row in rows] for name in self.columns]
+        )
+
+    def validate_columns(
+        self, columns: Sequence[Sequence[str]]
+    ) -> List[Optional[ValidationError]]:
+        """Validates a batch of rows provided as columns ordered as the validator columns.
+
+        :param columns: values of each column for the rows to be validated.
+        :type columns: Sequence[Sequence[str]]
+        :return: the validation error for each row in the batch or None for valid rows.
+        :rtype: List[Optional[ValidationError]]
+        """
+        return [
+            ValidationError.combine(errs) if errs else None
+            for errs in self._column_errors(columns)
+        ]
+
+    def _column_errors(
+        self, columns: Sequence[Sequence[str]], count: Optional[int] = None
+    ) -> List[Optional[List[ValidationError]]]:
+        """Returns the errors for each row of a batch provided as columns, None for valid rows.
+
+        Each column is validated at once using `bulk_validate`; only the values found to be
+        invalid are validated again to get the error for their row.
+        """
+        if count is None:
+            count = len(columns[0]) if columns else 0
+
+        errors: List[Optional[List[ValidationError]]] = [None] * count
+        for (name, validator), column in zip(self.columns.items(), columns):
+            flags = bulk_validate(validator, column)
+            for idx, (value, valid) in enumerate(zip(column, flags)):
+                # empty values are missing whether or not the column validator accepts them
+                if valid and value:
+                    continue
+
+                err = self._error(name, validator, value)
+                row_errors = errors[idx]
+                if row_errors is None:
+                    errors[idx] = [err]
+                else:
+                    row_errors.append(err)
+
+        return errors
+
+    def is_valid(self, row: Record) -> bool:
         self.err = None
 
-        try:
-            self(row)
-            return True
-        except ValidationError as ex:
-            self.err = ex
+        errors = self.errors(row)
+        if errors:
+            self.err = ValidationError.combine(errors)
             return False
+
+        return True
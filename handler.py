@@ -1,31 +1,66 @@
 """Defines handler for processing CSV file uploaded to S3 into an SQLite database.
 """
+import csv
 import logging
-import mimetypes
 import os
 import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import chain, islice
+from operator import itemgetter
 from pathlib import Path
-from typing import Any, Iterator, List
+from queue import Queue
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TypeVar
 
-from base import AttrDict, AttrDictReader, RowValidator, S3ObjInfo
+from base import MAX_TRANSFERS, AttrDict, Row, RowValidator, S3ObjInfo
 
 logging.basicConfig(format='%(levelname)s - %(module)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__file__)
 
 DB_KEY = 'uploads.db3'
-MIMETYPE_CSV = 'text/csv'
+SUFFIX_CSV = '.csv'
+MAX_DOWNLOAD_WORKERS = MAX_TRANSFERS
+PIPELINE_DEPTH = 8
+READ_BUFFER_SIZE = 1024 * 1024
+SNIFF_SIZE = 512
+
+# leading bytes of binary file types commonly uploaded in place of csv files
+BINARY_SIGNATURES = (
+    b'\x89PNG\r\n\x1a\n',  # png
+    b'\xff\xd8\xff',  # jpeg
+    b'GIF8',  # gif
+    b'%PDF',  # pdf
+    b'PK\x03\x04',  # zip, xlsx
+    b'\x1f\x8b',  # gzip
+)
 
 BASE_DIR = Path(__file__).parent
 TEMP_DIR = Path('/tmp')
 
 row_validator = RowValidator()
 
+T = TypeVar('T')
+
 
 class DB:
-    _DML_INSERT = 'INSERT INTO uploads VALUES (:batch, :start, :end, :records, :pass, :message)'
+    _DML_INSERT = 'INSERT INTO uploads VALUES (?, ?, ?, ?, ?, ?)'
+
+    # the database only lives in /tmp for the duration of an invocation and is uploaded back
+    # to S3 on success, hence durability is traded for bulk insert speed
+    _PRAGMAS = (
+        'PRAGMA journal_mode=MEMORY',
+        'PRAGMA synchronous=OFF',
+        'PRAGMA temp_store=MEMORY',
+        'PRAGMA cache_size=-16384',
+    )
 
     def __init__(self, conn: sqlite3.Connection):
-        self.conn = conn
+        self.conn = self.configure(conn)
+
+    @property
+    def changed(self) -> bool:
+        """Indicates whether rows were written through the connection since it was opened."""
+        return self.conn.total_changes > 0
 
     def count(self):
         """Returns the total number of records within the 'uploads' table."""
@@ -42,14 +77,38 @@ class DB:
         cur = self.conn.execute('SELECT * FROM uploads WHERE batch = ?', (batch,))
         return cur.fetchall()
 
-    def insert(self, rows: List[AttrDict]):
+    def insert(self, rows: Iterable[Row]):
         """Adds provided rows to the 'uploads' table.
 
+        The rows are added within the current transaction which is left to the caller to
+        commit. Rows are pulled from the iterable one at a time hence it can be a generator.
+
         :param rows: records to be added to the database.
-        :type rows: List[AttrDict]
+        :type rows: Iterable[Row]
         """
         self.conn.executemany(self._DML_INSERT, rows)
-        self.conn.commit()
+
+    def insert_many(self, rows: Iterable[Row]):
+        """Adds provided rows to the 'uploads' table within a single transaction.
+
+        The transaction is committed once all rows are added and rolled back on error.
+
+        :param rows: records to be added to the database.
+        :type rows: Iterable[Row]
+        """
+        with self.conn:
+            self.insert(rows)
+
+    @classmethod
+    def configure(cls, conn: sqlite3.Connection) -> sqlite3.Connection:
+        """Applies the bulk loading PRAGMAs to the provided connection.
+
+        This is done for all connections wrapped by a `DB` instance.
+        """
+        for pragma in cls._PRAGMAS:
+            conn.execute(pragma)
+
+        return conn
 
     @classmethod
     def create_database(cls, filepath: Path) -> sqlite3.Connection:
@@ -71,14 +130,18 @@ class DB:
 
     @classmethod
     def connect(cls, info: S3ObjInfo) -> 'DB':
-        """Returns a connection to the SQLite database at the provided path if it exists otherwise
-        a new database is created.
+        """Returns a connection to the SQLite database downloaded from S3.
+
+        A new database is created only when S3 reports that there is no object at the key.
+        Other download failures are raised, so an existing database is never replaced by a
+        blank one. The object is only fetched when the HEAD request made by the transfer
+        manager finds it, so a missing database costs a single round trip.
         """
         info.download(TEMP_DIR)
-        if info.local_exists:
-            conn = sqlite3.connect(info.local_filepath)
-        else:
+        if info.not_found:
             conn = cls.create_database(info.local_filepath)
+        else:
+            conn = sqlite3.connect(info.local_filepath)
 
         return DB(conn)
 
@@ -96,48 +159,243 @@ def cleanup_resources(infos: List[S3ObjInfo]):
     logger.info(f'{count}/{len(infos)} deleted.')
 
 
-def process_records(filepath: Path, db: DB, batch_size: int = 50):
-    def iterate_records() -> Iterator[List[AttrDict]]:
-        with filepath.open('r') as fp:
-            reader = AttrDictReader(fp)
+def save_database(db: DB, info: S3ObjInfo) -> bool:
+    """Uploads the database back to S3 if it was created or had rows written to it.
+
+    :param db: database to be uploaded.
+    :type db: DB
+    :param info: S3 object the database was retrieved from.
+    :type info: S3ObjInfo
+    :return: True if the database was uploaded.
+    :rtype: bool
+    """
+    if not (info.not_found or db.changed):
+        logger.info('Database unchanged, upload skipped.')
+        return False
+
+    info.upload()
+    return True
+
+
+def is_csv(name: str) -> bool:
+    """Returns True if the provided file name or S3 key has a csv extension."""
+    return name.lower().endswith(SUFFIX_CSV)
+
+
+def looks_like_csv(filepath: Path) -> bool:
+    """Returns True if the leading bytes of the provided file look like csv content.
+
+    This cheaply rejects binary files with a csv extension before a csv reader is created.
+    """
+    with filepath.open('rb') as fp:
+        head = fp.read(SNIFF_SIZE)
+
+    if not head or head.startswith(BINARY_SIGNATURES) or b'\x00' in head:
+        return False
+
+    return b',' in head
+
+
+def pipelined(items: Iterator[T], depth: int = PIPELINE_DEPTH) -> Iterator[T]:
+    """Yields items from the provided iterator which is consumed on a worker thread.
+
+    This allows the work done in producing items to overlap with that done by the caller in
+    consuming them. At most `depth` items are buffered between the two threads.
+
+    :param items: iterator to be consumed on the worker thread.
+    :type items: Iterator[T]
+    :param depth: maximum number of items buffered ahead of the caller.
+    :type depth: int
+    :return: the items in the order produced.
+    :rtype: Iterator[T]
+    """
+    queue: Queue = Queue(maxsize=depth)
+    stopped = threading.Event()
+    done, item = object(), None
+
+    def produce():
+        try:
+            for item in items:
+                if stopped.is_set():
+                    break
+                queue.put(item)
+        finally:
+            queue.put(done)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(produce)
+        try:
+            while True:
+                item = queue.get()
+                if item is done:
+                    break
+                yield item
+        finally:
+            # drain the queue so a producer blocked on a full queue gets to stop
+            stopped.set()
+            while item is not done:
+                item = queue.get()
+
+        future.result()
+
+
+def read_records(filepath: Path, batch_size: int = 1000) -> Iterator[List[Row]]:
+    """Reads and validates the records of a csv file.
+
+    :param filepath: path to the csv file to be read.
+    :type filepath: Path
+    :param batch_size: number of records read and validated at a time.
+    :type batch_size: int
+    :return: batches of the valid records within the file.
+    :rtype: Iterator[List[Row]]
+    """
+    # check that file is csv
+    if not is_csv(filepath.name) or not looks_like_csv(filepath):
+        logger.debug(f'Skipping non csv file: {filepath.name}')
+        return
+
+    columns = list(row_validator.columns)
 
-            rows: List[AttrDict] = []
-            for row in reader:
-                if not row_validator.is_valid(row):  # type: ignore
-                    logger.debug(f'Invalid row encountered. Error: {row_validator.err}.')
+    # the few distinct 'pass' values are shared by rows rather than each row holding a copy
+    pass_values: Dict[str, str] = {}
+
+    with filepath.open('r', buffering=READ_BUFFER_SIZE, encoding='utf-8', newline='') as fp:
+        reader = csv.reader(fp)
+
+        header = next(reader, None) or []
+        missing = [name for name in columns if name not in header]
+        if missing:
+            logger.debug(f'Invalid file encountered. Missing column(s): {missing}.')
+            return
+
+        # values are picked by position in the 'uploads' table column order
+        indices = [header.index(name) for name in columns]
+        row_values, width = itemgetter(*indices), max(indices) + 1
+
+        while True:
+            chunk = list(islice(reader, batch_size))
+            if not chunk:
+                break
+
+            batch: List[tuple] = []
+            for fields in chunk:
+                if not fields:  # blank line
+                    continue
+                if len(fields) < width:
+                    fields += [''] * (width - len(fields))
+                batch.append(row_values(fields))
+
+            rows: List[Row] = []
+            errors = row_validator.validate_columns(list(zip(*batch)))
+            for values, err in zip(batch, errors):
+                if err is not None:
+                    logger.debug(f'Invalid row encountered. Error: {err}.')
                     continue
 
-                rows.append(row)  # type: ignore
-                if len(rows) == batch_size:
-                    yield rows
-                    rows = []
+                batch_, start, end, records, pass_, message = values
+                pass_ = pass_values.setdefault(pass_, pass_)
+                rows.append(Row(batch_, start, end, records, pass_, message))
 
             if rows:
                 yield rows
-                rows = []
 
-    # check that file is csv
-    file_type, _ = mimetypes.guess_type(filepath)
-    if file_type is None or file_type != MIMETYPE_CSV:
-        return
 
-    # process file records and insert to database
-    for rows in iterate_records():
-        db.insert(rows)
+def process_records(filepath: Path, db: DB, batch_size: int = 1000):
+    # process file records and insert to database within a single transaction; records are
+    # read and validated on a worker thread as the connection is bound to the current thread
+    db.insert_many(chain.from_iterable(pipelined(read_records(filepath, batch_size))))
+
+
+def _load_records(filepath: Path, batch_size: int) -> List[Row]:
+    return list(chain.from_iterable(read_records(filepath, batch_size)))
+
+
+def process_uploads(
+    filepaths: List[Path], db: DB, workers: Optional[int] = None, batch_size: int = 1000
+) -> List[Optional[Exception]]:
+    """Processes the records of the provided csv files into the database.
+
+    With multiple files, the files are read and validated in parallel across worker processes
+    and their valid records inserted within a single transaction. Files are processed one
+    after the other with `process_records` where worker processes are unavailable.
+
+    :param filepaths: paths to the csv files to be processed.
+    :type filepaths: List[Path]
+    :param db: database to which the records are added.
+    :type db: DB
+    :param workers: maximum number of worker processes; defaults to the number of CPUs.
+    :type workers: Optional[int]
+    :return: the error encountered processing each file or None for processed files.
+    :rtype: List[Optional[Exception]]
+    """
+    errors: List[Optional[Exception]] = [None] * len(filepaths)
+
+    executor = None
+    if len(filepaths) > 1:
+        try:
+            executor = ProcessPoolExecutor(max_workers=workers)
+        except (OSError, NotImplementedError) as ex:
+            # e.g. AWS Lambda provides no /dev/shm which is required for worker processes
+            logger.debug(f'Worker processes unavailable, processing files serially. {ex}')
+        except Exception as ex:
+            return [ex] * len(filepaths)
+
+    if executor is None:
+        for idx, filepath in enumerate(filepaths):
+            try:
+                process_records(filepath, db, batch_size)
+            except Exception as ex:
+                errors[idx] = ex
+
+        return errors
+
+    results: List[Optional[List[Row]]] = [None] * len(filepaths)
+    try:
+        with executor:
+            futures = [executor.submit(_load_records, path, batch_size) for path in filepaths]
+            for idx, future in enumerate(futures):
+                try:
+                    results[idx] = future.result()
+                except Exception as ex:
+                    errors[idx] = ex
+    except Exception as ex:
+        # e.g. the pool breaks once a worker process is killed and rejects further work
+        errors = [err or (ex if rows is None else None) for err, rows in zip(errors, results)]
+
+    try:
+        db.insert_many(chain.from_iterable(rows for rows in results if rows is not None))
+    except Exception as ex:
+        errors = [err or ex for err in errors]
+
+    return errors
 
 
 def download_s3_objects(event: AttrDict) -> Iterator[S3ObjInfo]:
     """Download files uploaded to S3 and return valid files for further processing.
 
+    Only objects with a csv extension are downloaded, the others are returned as is.
+
     :param event: event data.
     :type event: AttrDict
     :return: list of S3ObjInfo that are to be processed further.
     :rtype: S3ObjInfo
     """
-    for record in event.Records:
-        info = S3ObjInfo(record.s3.bucket.name, record.s3.object.key)
-        info.download(TEMP_DIR)
-        yield info
+
+    def download(info: S3ObjInfo) -> S3ObjInfo:
+        if is_csv(info.key):
+            try:
+                info.download(TEMP_DIR)
+            except Exception:
+                pass  # already logged; the file is skipped as it has no local copy
+        return info
+
+    infos = [S3ObjInfo(record.s3.bucket.name, record.s3.object.key) for record in event.Records]
+    if not infos:
+        return
+
+    # downloads are I/O bound hence are overlapped across threads
+    with ThreadPoolExecutor(max_workers=min(len(infos), MAX_DOWNLOAD_WORKERS)) as executor:
+        yield from executor.map(download, infos)
 
 
 def handler(event: dict, context: Any):
@@ -146,7 +404,7 @@ def handler(event: dict, context: Any):
 
     logger.info('Downloading file(s) uploaded to s3 ...')
     for info in download_s3_objects(AttrDict(event)):
-        if info.content_type != 'text/csv':
+        if not is_csv(info.key) or not info.local_exists:
             logger.info(f'Skipping non csv file: {info.key}')
             skipped.append(info)
             continue
@@ -161,19 +419,27 @@ def handler(event: dict, context: Any):
     # retrieve or create sqlite database to be written to
     db_bucket = os.environ.get('DB_BUCKET') or infos[0].bucket
     db_info = S3ObjInfo(db_bucket, DB_KEY)
-    db = DB.connect(db_info)
+    try:
+        db = DB.connect(db_info)
+    except Exception as ex:
+        logger.error(f'Database retrieval from S3 failed. Error: {ex}')
+        cleanup_resources(infos + skipped + [db_info])
+        return {'status_code': 500, 'message': 'Database retrieval failed.'}
 
     # process and add csv records into database
-    for info in infos:
-        try:
-            process_records(info.local_filepath, db)
+    try:
+        errors = process_uploads([info.local_filepath for info in infos], db)
+    except Exception as ex:
+        errors = [ex] * len(infos)
+    for info, err in zip(infos, errors):
+        if err is None:
             logger.info(f'Records processed and written to database for: {info.key}')
-        except Exception as ex:
-            logger.error(f'Error processing csv records. File: {info.key}. Error: {ex}')
+        else:
+            logger.error(f'Error processing csv records. File: {info.key}. Error: {err}')
 
     # upload updated database back to s3
     try:
-        db_info.upload()
+        save_database(db, db_info)
         logger.info('Operation completed successfully!')
     except Exception as ex:
         logger.error(f'Database upload back to S3 failed. Error: {ex}')
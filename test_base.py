@@ -1,14 +1,21 @@
 import pytest
+from botocore.exceptions import ClientError
 
+import base
 from base import (
     AttrDict,
     BatchValidator,
     BoolValidator,
     DateValidator,
+    FloatValidator,
     FuncValidator,
+    IntValidator,
     NotEmptyValidator,
     RowValidator,
+    S3ObjInfo,
     ValidationError,
+    bulk_validate,
+    checker,
 )
 
 
@@ -60,6 +67,50 @@ class TestAttrDict:
         assert isinstance(obj.rows[0], AttrDict) is True
         assert isinstance(obj.rows[1], int) is True
 
+    def test_array_values_converted_only_once(self):
+        obj = AttrDict({'rows': [{'foo': 'bar'}, 77]})
+        rows = obj.rows
+        assert obj.rows is rows
+        assert obj.rows[0] is rows[0]
+
+    def test_tuple_values_returned_as_lists(self):
+        obj = AttrDict({'a': (1, 2), 'rows': ({'foo': 'bar'},)})
+        assert obj.a == [1, 2]
+        assert isinstance(obj.rows, list) and isinstance(obj.rows[0], AttrDict)
+
+
+class TestS3ObjInfo:
+    @pytest.mark.parametrize(
+        'key, local_key',
+        [
+            ('file1.csv', 'file1.csv'),
+            ('uploads/2021/file1.csv', 'uploads2021file1.csv'),
+            ('uploads%2Ffile%201.csv', 'uploadsfile 1.csv'),
+        ],
+    )
+    def test_generate_local_name(self, key, local_key):
+        prefix, name = S3ObjInfo('bucket', key)._generate_local_name().split('_', 1)
+        assert len(prefix) == 32
+        assert name == local_key
+
+    @pytest.mark.parametrize('code, not_found', [('404', True), ('403', False)])
+    def test_download_raises_errors_other_than_not_found(
+        self, monkeypatch, tmp_path, code, not_found
+    ):
+        class S3:
+            def download_file(self, *args, **kwargs):
+                raise ClientError({'Error': {'Code': code}}, 'HeadObject')
+
+        monkeypatch.setattr(base, 's3', S3())
+        info = S3ObjInfo('bucket', 'uploads.db3')
+        if not_found:
+            info.download(tmp_path)
+        else:
+            pytest.raises(ClientError, info.download, tmp_path)
+
+        assert info.not_found is not_found
+        assert info.local_exists is False
+
 
 class TestBatchValidator:
     validator = BatchValidator()
@@ -116,6 +167,11 @@ class TestBatchValidator:
             except (Exception):
                 pytest.fail(f'Unexpected error. Value: {batch_value}')
 
+    def test_fails_for_non_ascii_letters(self):
+        for batch_value in ['fUBImUCTzQUsbRVVNSoé', 'ASikVvAGnNIqCwFJKr–s']:
+            assert len(batch_value) == self.validator.length
+            pytest.raises(ValidationError, self.validator, batch_value)
+
 
 class TestBoolValidator:
     validator = BoolValidator()
@@ -181,6 +237,30 @@ class TestDateValidator:
             except ValueError:
                 pytest.fail('Unexpected error')
 
+    def test_fails_for_iso_variants_not_matching_format(self):
+        validator = DateValidator(format='%Y-%m-%d')
+        for value in [
+            '20210101',
+            '2021-W01-1',
+            '2021-01-01T11:01:01',
+            '2021-1-01',  # fields not zero-padded
+            '2021-01-1',
+        ]:
+            pytest.raises(ValidationError, validator, value)
+
+        validator = DateValidator(format='%Y-%m-%dT%H:%M:%S')
+        for value in [
+            '2020-11-11 23:58:40',
+            '2020-11-11T23:58',
+            '2020-11-11T23:58:40+01:00',
+            '2020-11-11T23:58:4Z',
+            '2020-11-11T23:58:40.5',
+            '2003-9-12T03:32:48',  # fields not zero-padded
+            '2003-09-12T3:32:48',
+            '2003-09- 2T03:32:48',
+        ]:
+            pytest.raises(ValidationError, validator, value)
+
 
 class TestFuncValidator:
     int_validator = FuncValidator(int)
@@ -226,6 +306,83 @@ class TestFuncValidator:
                 pytest.fail(f'Unexpected error: {ex}')
 
 
+class TestIntValidator:
+    validator = IntValidator()
+
+    def test_fails_for__char__alphanum__decimal__empty__value(self):
+        values = ['one', '6e', '5b', '3.14', '', '-', '+', '1-2', '１２', '-٣', '1_000', ' ']
+        for value in values:
+            pytest.raises(ValidationError, self.validator, value)
+
+    def test_passes_for_int_string_value(self):
+        values = ['0', '1', '1234', '192873', '-12', '+12', ' 12', '12\n']
+        for value in values:
+            try:
+                self.validator(value)
+            except Exception as ex:
+                pytest.fail(f'Unexpected error: {ex}')
+
+    def test_unsigned_rejects_signed_values(self):
+        validator = IntValidator(signed=False)
+        for value in ['-12', '+12', '-0', '１２']:
+            pytest.raises(ValidationError, validator, value)
+        flags = bulk_validate(validator, ['0', '100', '-1', '10.6'])
+        assert flags == [True, True, False, False]
+
+
+class TestFloatValidator:
+    validator = FloatValidator()
+
+    def test_fails_for__char__alphanum__decimal__value(self):
+        values = ['one', '6e', '5b', '3.14b', '', '.', '1.2.3', 'inf', 'nan']
+        for value in values:
+            pytest.raises(ValidationError, self.validator, value)
+
+    def test_passes_for__int__float__string_value(self):
+        values = ['0', '1', '1234', '1e3', '-3.14', '+.5', '5.', '2.5E-3']
+        for value in values:
+            try:
+                self.validator(value)
+            except Exception as ex:
+                pytest.fail(f'Unexpected error: {ex}')
+
+
+class TestBulkValidate:
+    @pytest.mark.parametrize(
+        'validator, values',
+        [
+            (BatchValidator(), ['fUBImUCTzQUsbRVVNSoM', 'qwerty', '9kzuKXkRCjkvdgvgpLsC', '']),
+            (BoolValidator(), ['True', 'false', 'tRue', 'yes', '1', '']),
+            (DateValidator(format='%Y-%m-%d'), ['2021-01-01', '2021-02-29', '20210101', '']),
+            (IntValidator(), ['0', '-12', '3.14', 'one', '']),
+            (IntValidator(signed=False), ['0', '100', '-12', '3.14', '']),
+            (FloatValidator(), ['1e3', '-3.14', '6e', 'inf', '']),
+            (FuncValidator(int), ['0', '1234', '3.14', '']),
+            (NotEmptyValidator, ['one', '    ', '']),
+        ],
+    )
+    def test_flags_match_validator_outcome_for_each_value(self, validator, values):
+        expected = []
+        for value in values:
+            try:
+                validator(value)
+                expected.append(True)
+            except ValidationError:
+                expected.append(False)
+
+        assert bulk_validate(validator, values) == expected
+        assert True in expected and False in expected
+        assert [validator.check(value) for value in values] == expected
+
+    def test_validators_without_check_are_called(self):
+        def validator(value):
+            if value != 'ok':
+                raise ValidationError('not ok')
+
+        assert bulk_validate(validator, ['ok', 'nope']) == [True, False]
+        assert checker(validator)('ok') and not checker(validator)('nope')
+
+
 class TestRowValidator:
     validator = RowValidator()
 
@@ -326,3 +483,92 @@ class TestRowValidator:
             assert self.validator.is_valid(row) is True
         except ValidationError:
             pytest.fail('Unexpected error')
+
+    @pytest.mark.parametrize(
+        'records, valid',
+        [
+            ('100', True),
+            (' 100', True),  # surrounding whitespace is dropped by SQLite
+            ('100 ', True),
+            ('-1', False),  # counts are unsigned
+            ('1_000', False),  # accepted by int but stored as TEXT by SQLite
+            ('０', False),
+        ],
+    )
+    def test_records_accepts_only_values_stored_as_integers(self, records, valid):
+        row = AttrDict(
+            {
+                'batch': 'oIcACSLYuEWKXVHNeXdK',
+                'start': '2003-09-12T03:32:48',
+                'end': '2019-05-29T11:51:43',
+                'records': records,
+                'pass': 'true',
+                'message': 'the big brown fox',
+            }
+        )
+        assert self.validator.is_valid(row) is valid
+        assert (self.validator.validate_batch([row])[0] is None) is valid
+
+    def test_errors_reports_all_invalid_columns(self):
+        row = AttrDict(
+            {
+                'batch': 'oIcACSLYuEWKXVHNeXdKZYZ',  # invalid batch length
+                'start': '2003-09-12T03:32:48',
+                'end': '2019-05-29T11:51:43',
+                'records': '10.6',  # invalid records value
+                'pass': 'true',
+            }  # missing message
+        )
+
+        errors = self.validator.errors(row)
+        assert len(errors) == 3
+        assert all(isinstance(err, ValidationError) for err in errors)
+
+        assert self.validator.is_valid(row) is False
+        for err in errors:
+            assert str(err) in str(self.validator.err)
+
+        with pytest.raises(ValidationError) as exc_info:
+            self.validator(row)
+        assert str(exc_info.value) == str(self.validator.err)
+
+    def test_subclass_columns_are_validated(self):
+        class CustomRowValidator(RowValidator):
+            columns = AttrDict({'batch': BatchValidator(5)})
+
+        validator = CustomRowValidator()
+        assert validator.is_valid(AttrDict(batch='query')) is True
+        assert validator.is_valid(AttrDict(batch='queries')) is False
+        assert validator.validate_batch([AttrDict(batch='query')]) == [None]
+
+    @pytest.mark.parametrize('value', ['', None, 'note'])
+    def test_validate_batch_agrees_with_is_valid(self, value):
+        class CustomRowValidator(RowValidator):
+            columns = AttrDict({'note': FuncValidator(str)})
+
+        validator, row = CustomRowValidator(), AttrDict(note=value)
+        [err] = validator.validate_batch([row])
+        assert validator.is_valid(row) is (err is None) is bool(value)
+
+    def test_validate_batch_flags_only_invalid_rows(self):
+        valid = {
+            'batch': 'oIcACSLYuEWKXVHNeXdK',
+            'start': '2003-09-12T03:32:48',
+            'end': '2019-05-29T11:51:43',
+            'records': '100',
+            'pass': 'true',
+            'message': 'the big brown fox',
+        }
+        rows = [
+            AttrDict(valid),
+            AttrDict(valid, records='10.6'),  # invalid records value
+            AttrDict(valid, message=''),  # missing message
+            AttrDict(valid),
+        ]
+
+        errors = self.validator.validate_batch(rows)
+        assert len(errors) == len(rows)
+        assert errors[0] is None and errors[3] is None
+        assert isinstance(errors[1], ValidationError)
+        assert isinstance(errors[2], ValidationError)
+        assert str(errors[2]) == str(self.validator.errors(rows[2])[0])
@@ -1,9 +1,23 @@
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 
 import pytest
+from botocore.exceptions import ClientError
 
-from handler import process_records, DB
+import base
+from base import Row, S3ObjInfo
+import handler
+from handler import (
+    DB,
+    is_csv,
+    looks_like_csv,
+    pipelined,
+    process_records,
+    process_uploads,
+    save_database,
+)
 
 
 @pytest.fixture
@@ -86,3 +100,223 @@ class TestUploadProcessing:
             pytest.fail(f'Unexpected error. Error: {ex}')
 
         assert db.count() > 0
+
+    def test_process_records_picks_columns_by_header_name(self, db, tmp_path):
+        upload = tmp_path / 'upload.csv'
+        upload.write_text(
+            'message,pass,records,end,start,batch\n'
+            'one,True,10,2019-05-29T11:51:43,2003-09-12T03:32:48,oIcACSLYuEWKXVHNeXdK\n'
+            '\n'
+            'two,False,20,2019-05-29T11:51:43\n'  # short row
+            'three,False,30,2019-05-29T11:51:43,2003-09-12T03:32:48,tmoThtJPZsossGWXjUdz\n'
+        )
+
+        process_records(upload, db, batch_size=1)
+        rows = db.fetchall()
+        assert [row[0] for row in rows] == ['oIcACSLYuEWKXVHNeXdK', 'tmoThtJPZsossGWXjUdz']
+        assert rows[0][1:] == ('2003-09-12T03:32:48', '2019-05-29T11:51:43', 10, 'True', 'one')
+
+    def test_process_records_skips_binary_file_with_csv_extension(self, db, tmp_path):
+        upload = tmp_path / 'image.csv'
+        upload.write_bytes(Path('./fixtures/image.png').read_bytes())
+
+        assert looks_like_csv(upload) is False
+        process_records(upload, db)
+        assert db.count() == 0
+
+    @pytest.mark.parametrize(
+        'content, expected',
+        [
+            (b'batch,start,end,records,pass,message\n', True),
+            (b'"batch","start"\r\n"caf\xc3\xa9","x"', True),
+            (b'', False),
+            (b'no separators here', False),
+            (b'PK\x03\x04,', False),
+            (b'a,b\x00c', False),
+        ],
+    )
+    def test_looks_like_csv(self, tmp_path, content, expected):
+        upload = tmp_path / 'upload.csv'
+        upload.write_bytes(content)
+        assert looks_like_csv(upload) is expected
+
+    @pytest.mark.parametrize(
+        'name, expected',
+        [
+            ('file1.csv', True),
+            ('uploads/FILE1.CSV', True),
+            ('image.png', False),
+            ('file1.csv.png', False),
+            ('csv', False),
+        ],
+    )
+    def test_is_csv(self, name, expected):
+        assert is_csv(name) is expected
+
+    def test_process_uploads_processes_files_in_parallel(self, db):
+        uploads = [
+            Path('./fixtures/file3.csv'),  # bad file, all records skipped
+            Path('./fixtures/file1.csv'),  # valid file with invalid records
+            Path('./fixtures/image.png'),  # invalid file
+            Path('./fixtures/file2.csv'),  # valid file with invalid records
+            Path('./fixtures/missing.csv'),  # unreadable file
+        ]
+
+        errors = process_uploads(uploads, db, workers=2)
+        assert errors[:4] == [None] * 4
+        assert isinstance(errors[4], FileNotFoundError)
+
+        expected = 0
+        for upload in uploads[:4]:
+            expected += sum(len(rows) for rows in handler.read_records(upload))
+        assert db.count() == expected > 0
+        assert db.conn.in_transaction is False
+
+    def test_process_uploads_processes_files_serially_without_worker_processes(
+        self, db, monkeypatch
+    ):
+        def unavailable(*args, **kwargs):
+            raise OSError('Function not implemented')
+
+        monkeypatch.setattr(handler, 'ProcessPoolExecutor', unavailable)
+        uploads = [Path('./fixtures/file1.csv'), Path('./fixtures/missing.csv')]
+
+        errors = process_uploads(uploads, db)
+        assert errors[0] is None
+        assert isinstance(errors[1], FileNotFoundError)
+        assert len(db.fetch_by_batch('pMQaQdvxVbimtnsHRAds')) == 1
+
+    def test_process_uploads_reports_pool_failures_per_file(self, db, monkeypatch):
+        class BrokenExecutor(ThreadPoolExecutor):
+            def submit(self, *args, **kwargs):
+                raise BrokenProcessPool('A child process terminated abruptly')
+
+        uploads = [Path('./fixtures/file1.csv'), Path('./fixtures/file2.csv')]
+        errors = process_uploads(uploads, db, workers=0)
+        assert all(isinstance(err, ValueError) for err in errors)
+
+        monkeypatch.setattr(handler, 'ProcessPoolExecutor', BrokenExecutor)
+        errors = process_uploads(uploads, db)
+        assert all(isinstance(err, BrokenProcessPool) for err in errors)
+        assert db.count() == 0
+
+
+class TestDB:
+    def test_configure_applies_bulk_loading_pragmas(self, db):
+        assert db.conn.execute('PRAGMA temp_store').fetchone()[0] == 2  # memory
+        assert db.conn.execute('PRAGMA cache_size').fetchone()[0] == -16384
+
+        conn = DB.configure(sqlite3.connect(':memory:'))
+        assert conn.execute('PRAGMA synchronous').fetchone()[0] == 0
+        conn.close()
+
+        assert db.conn.execute('PRAGMA journal_mode').fetchone()[0] == 'memory'
+        assert db.conn.execute('PRAGMA synchronous').fetchone()[0] == 0
+
+    def test_insert_binds_row_values_in_column_order(self, db):
+        row = Row(
+            'oIcACSLYuEWKXVHNeXdK',
+            '2003-09-12T03:32:48',
+            '2019-05-29T11:51:43',
+            '100',
+            'true',
+            'fox',
+        )
+        db.insert([row])
+
+        assert db.fetchall() == [tuple(row[:3]) + (100,) + tuple(row[4:])]
+        cur = db.conn.execute('SELECT typeof(records) FROM uploads')
+        assert cur.fetchone()[0] == 'integer'
+
+    def test_insert_many_rolls_back_on_error(self, db):
+        row = Row(
+            'oIcACSLYuEWKXVHNeXdK',
+            '2003-09-12T03:32:48',
+            '2019-05-29T11:51:43',
+            '1',
+            'true',
+            'a',
+        )
+
+        def rows():
+            yield row
+            raise ValueError('bad row')
+
+        pytest.raises(ValueError, db.insert_many, rows())
+        assert db.conn.in_transaction is False
+        assert db.count() == 0
+
+        db.insert_many([row, row])
+        assert db.count() == 2
+
+    @pytest.mark.parametrize('code', ['404', '403'])
+    def test_connect_creates_database_only_when_not_found(self, monkeypatch, tmp_path, code):
+        class S3:
+            def download_file(self, *args, **kwargs):
+                raise ClientError({'Error': {'Code': code}}, 'HeadObject')
+
+        monkeypatch.setattr(base, 's3', S3())
+        monkeypatch.setattr(handler, 'TEMP_DIR', tmp_path)
+        info = S3ObjInfo('bucket', handler.DB_KEY)
+        if code == '404':
+            assert DB.connect(info).count() == 0
+        else:
+            pytest.raises(ClientError, DB.connect, info)
+            assert list(tmp_path.iterdir()) == []
+
+    def test_save_database_uploads_only_changed_database(self, db, monkeypatch, tmp_path):
+        class S3:
+            uploads: list = []
+
+            def download_file(self, bucket, key, filename, **kwargs):
+                Path(filename).write_bytes(b'')
+
+            def upload_file(self, filename, bucket, key, **kwargs):
+                self.uploads.append(key)
+
+        monkeypatch.setattr(base, 's3', S3())
+        info = S3ObjInfo('bucket', handler.DB_KEY)
+        info.download(tmp_path)
+
+        assert save_database(db, info) is False
+        assert base.s3.uploads == []
+
+        process_records(Path('./fixtures/file2.csv'), db)
+        assert save_database(db, info) is True
+        assert base.s3.uploads == [handler.DB_KEY]
+
+    def test_process_records_commits_inserted_records(self, db):
+        process_records(Path('./fixtures/file2.csv'), db)
+        assert db.conn.in_transaction is False
+        assert db.count() > 0
+
+
+class TestPipelined:
+    def test_yields_all_items_in_order(self):
+        assert list(pipelined(iter(range(100)), depth=2)) == list(range(100))
+
+    def test_reraises_producer_error(self):
+        def items():
+            yield 1
+            raise ValueError('bad item')
+
+        consumed = []
+        with pytest.raises(ValueError):
+            for item in pipelined(items()):
+                consumed.append(item)
+
+        assert consumed == [1]
+
+    def test_stops_producer_when_consumer_stops_early(self):
+        produced = []
+
+        def items():
+            for i in range(100):
+                produced.append(i)
+                yield i
+
+        for item in pipelined(items(), depth=2):
+            if item == 3:
+                break
+
+        assert len(produced) < 100